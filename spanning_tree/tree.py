@@ -2,9 +2,12 @@
 Spanning Tree module.
 """
 
+import functools
+import heapq
 import logging
-import copy
+import math
 import random
+import weakref
 
 # traditional ephemeral port range
 # see: https://datatracker.ietf.org/doc/html/rfc6056#section-2.1
@@ -13,6 +16,20 @@ _EPHEMERAL_PORT_MIN = 1024
 
 _LOGGER = logging.getLogger(__name__)
 
+# bridges by id, so that cached shortest paths can be keyed by id
+_BRIDGES = weakref.WeakValueDictionary()
+
+def _invalidate_shortest_paths():
+    """
+    Drop the shortest paths cached for the current topology, so that they
+    neither go stale nor keep its bridges alive.
+
+    Only setting a listener changes the topology. A bridge that was just
+    created cannot be in any cached path, since every cached path keeps its
+    own bridges alive and lookups that fail are not cached.
+    """
+    _shortest_path_cached.cache_clear()
+
 def _ephemeral_port():
     """
     Generate an `ephemeral port <https://en.wikipedia.org/wiki/Ephemeral_port>`.
@@ -27,33 +44,108 @@ def shortest_path(root_bridge: 'Bridge', sending_bridge: 'Bridge'):
 
     returns: the shortest path to the root bridge.
     """
-    sending_bridge.send_bdpu(
-        BridgeProtocolDataUnit(
-            sending_bridge.name,
-            root_bridge.name))
+    return list(
+        _shortest_path_cached(
+            id(root_bridge),
+            id(sending_bridge)))
+
+def _dijkstra(sending_bridge: 'Bridge', root_id: int):
+    """
+    Run Dijkstra over the listener graph from the sending bridge until the
+    root bridge is reached. Bridges are numbered as they are discovered, their
+    listeners are only looked at once they are popped, and paths that cost at
+    least as much as the best one found to the root bridge are never queued.
+
+    returns: the total cost to the root bridge, or None if it is unreachable,
+    the index of the root bridge, the bridges numbered so far and the
+    predecessor of each.
+    """
+    bridges = [sending_bridge]
+    index = {id(sending_bridge): 0}
+    distances = [sending_bridge.cost]
+    predecessors = [-1]
+    best_cost = math.inf
+    queue = [(sending_bridge.cost, 0)]
+    while queue:
+        cost, node = heapq.heappop(queue)
+        bridge = bridges[node]
+        if id(bridge) == root_id:
+            return cost, node, bridges, predecessors
+
+        if cost > distances[node]:
+            continue
+
+        for listener in bridge.listeners:
+            listener_cost = cost + listener.cost
+            # nothing costing as much as the best known path to the root
+            # bridge can improve on it
+            if listener_cost >= best_cost:
+                continue
+
+            listener_index = index.get(id(listener))
+            if listener_index is None:
+                listener_index = index[id(listener)] = len(bridges)
+                bridges.append(listener)
+                distances.append(math.inf)
+                predecessors.append(-1)
+
+            if listener_cost < distances[listener_index]:
+                distances[listener_index] = listener_cost
+                predecessors[listener_index] = node
+                heapq.heappush(queue, (listener_cost, listener_index))
+                if id(listener) == root_id:
+                    best_cost = listener_cost
+
+    return None, -1, bridges, predecessors
+
+@functools.lru_cache(maxsize=4096)
+def _shortest_path_cached(root_id: int, send_id: int):
+    """
+    Compute the shortest path to the root bridge from the sending bridge,
+    caching the result for as long as the topology is unchanged.
 
-    received_bdpus = root_bridge.received_bdpus
+    returns: the shortest path to the root bridge, as a tuple.
+    """
+    cost, node, bridges, predecessors = _dijkstra(_BRIDGES[send_id], root_id)
+    if cost is None:
+        raise ValueError("No path to the root bridge.")
 
-    if _LOGGER.isEnabledFor(logging.DEBUG):
-        _LOGGER.debug("received_bdpus: %s", received_bdpus)
+    path = []
+    while node != -1:
+        path.append(bridges[node])
+        node = predecessors[node]
 
-    received_bdpus.sort(key=lambda bdpu: bdpu.total_cost)
+    path.reverse()
+    _LOGGER.debug("shortest_path: %s (total_cost=%s)", path, cost)
 
-    return received_bdpus[0].path
+    return tuple(path)
 
 class BridgeProtocolDataUnit:
     """
     A BDPU containing info necessary for Spanning Tree Protocol (STP) to work.
+
+    BDPUs are immutable; adding a bridge or a cost returns a new BDPU. The
+    path is kept as a chain of ``(bridge, previous)`` cells ending in None,
+    so BDPUs forwarded along diverging branches share their common prefix.
     """
 
-    def __init__(self, bridge_id, root_id):
+    __slots__ = ('_bridge_id', '_root_id', '_total_cost', '_path')
+
+    def __init__(
+            self,
+            bridge_id,
+            root_id,
+            total_cost: int = 0,
+            path: tuple = ()):
         self._bridge_id = bridge_id
         self._root_id = root_id
-        self._total_cost = 0
-        self._path = []
+        self._total_cost = total_cost
+        self._path = None
+        for bridge in path:
+            self._path = (bridge, self._path)
 
     def __repr__(self):
-        return self.__str__()
+        return f"BDPU({self._bridge_id},{self._total_cost})"
 
     def __str__(self):
         return (
@@ -63,17 +155,43 @@ class BridgeProtocolDataUnit:
             f"path={self.path}"
         )
 
-    def add_bridge(self, bridge):
+    @classmethod
+    def _from_path_cell(cls, bridge_id, root_id, total_cost: int, path):
+        """
+        Create a BDPU from a path cell, without rebuilding the chain.
+
+        returns: the created BDPU.
+        """
+        bdpu = cls.__new__(cls)
+        bdpu._bridge_id = bridge_id
+        bdpu._root_id = root_id
+        bdpu._total_cost = total_cost
+        bdpu._path = path
+        return bdpu
+
+    def add_bridge(self, bridge, cost: int = 0):
         """
-        Add a bridge to the path tracked by the BDPU.
+        Add a bridge, and optionally its cost, to the path tracked by the BDPU.
+
+        returns: a BDPU whose path ends with the bridge.
         """
-        self._path.append(bridge)
+        return self._from_path_cell(
+            self._bridge_id,
+            self._root_id,
+            self._total_cost + cost,
+            (bridge, self._path))
 
     def add_cost(self, cost: int):
         """
         Add the cost of a bridge to the total cost of the path.
+
+        returns: a BDPU whose total cost includes the cost.
         """
-        self._total_cost += cost
+        return self._from_path_cell(
+            self._bridge_id,
+            self._root_id,
+            self._total_cost + cost,
+            self._path)
 
     @property
     def bridge_id(self):
@@ -88,18 +206,25 @@ class BridgeProtocolDataUnit:
         """
         Create a copy of this BDPU.
 
-        returns: a copy of this BDPU.
+        returns: this BDPU, since BDPUs are immutable.
         """
-        return copy.copy(self)
+        return self
 
     @property
     def path(self):
         """
         The path taken by the BDPU.
 
-        returns: the path taken by the BDPU.
+        returns: the path taken by the BDPU, as a tuple.
         """
-        return self._path
+        path = []
+        cell = self._path
+        while cell is not None:
+            bridge, cell = cell
+            path.append(bridge)
+
+        path.reverse()
+        return tuple(path)
 
     @property
     def root_id(self):
@@ -124,18 +249,26 @@ class Port:
     A port.
     """
 
+    __slots__ = ('_number', '_priority', '_listener', '_listened', '_is_root')
+
     def __init__(self, number: int = None, priority: int = 1):
-        if number and (number < _EPHEMERAL_PORT_MIN or number > _EPHEMERAL_PORT_MAX):
+        if number is None:
+            self._number = _ephemeral_port()
+        elif _EPHEMERAL_PORT_MIN <= number <= _EPHEMERAL_PORT_MAX:
+            self._number = number
+        else:
             raise ValueError("Outside port range.")
 
-        self._number = number if number else _ephemeral_port()
         self._priority = priority
         self._listener = None
         self._listened = None
         self._is_root = False
 
-    def __eq__(self, other: 'Port'):
-        return self.number == other.number
+    def __eq__(self, other: object):
+        return isinstance(other, Port) and self._number == other._number
+
+    def __hash__(self):
+        return hash(self._number)
 
     def connect(self, other: 'Port'):
         """
@@ -197,6 +330,17 @@ class Bridge:
     A bridge.
     """
 
+    __slots__ = (
+        '_name',
+        '_ports',
+        '_is_root',
+        '_listened',
+        '_listeners',
+        '_cost',
+        '_received_bdpus',
+        '__weakref__',
+    )
+
     def __init__(self, name: str, *ports: Port, cost: int = 1):
         self._name = name
         self._ports = ports if ports else [Port()]
@@ -205,26 +349,60 @@ class Bridge:
         self._listeners = {}
         self._cost = cost
         self._received_bdpus = []
+        _BRIDGES[id(self)] = self
 
     def __eq__(self, other: object):
         return isinstance(other, Bridge) and self.name == other.name
 
+    def __hash__(self):
+        return hash(self.name)
+
     def __repr__(self):
         return self.__str__()
 
     def __str__(self):
         return f"[Bridge] {self.name}"
 
-    def connect(self, other: 'Bridge'):
+    def _free_port(self, links: dict):
         """
-        Connect to another bridge.
+        Find the first port that is not linked to a bridge in the direction
+        of the links yet. Ports are linked in order and never unlinked, so
+        this is the port after the last linked one.
+
+        returns: the first port that is not linked, or None.
         """
-        unallocated_port = self.unallocated_port
-        if not unallocated_port:
+        return self._ports[len(links)] if len(links) < len(self._ports) else None
+
+    def _free_port_or_raise(self, links: dict):
+        """
+        Find the first port that is not linked to a bridge in the direction
+        of the links yet.
+
+        returns: the first port that is not linked.
+        """
+        free_port = self._free_port(links)
+        if not free_port:
             raise ValueError("No free ports.")
 
+        return free_port
+
+    def connect(self, other: 'Bridge'):
+        """
+        Connect to another bridge.
+        """
+        unallocated_port = self._free_port_or_raise(self._listened)
+        listener_port = other.set_listener(self)
+        unallocated_port.connect(listener_port)
         self._listened[unallocated_port.number] = other
-        other.set_listener(self)
+
+    @property
+    def cost(self):
+        """
+        The cost of sending through the bridge.
+
+        returns: the cost of sending through the bridge.
+        """
+        return self._cost
 
     def elect(self):
         """
@@ -241,14 +419,32 @@ class Bridge:
         """
         return self._is_root
 
+    @property
+    def best_bdpu(self):
+        """
+        The received BDPU with the lowest total cost.
+
+        returns: the received BDPU with the lowest total cost, or None.
+        """
+        return min(
+            self._received_bdpus,
+            key=lambda bdpu: bdpu.total_cost,
+            default=None)
+
     @property
     def received_bdpus(self):
         """
         The received BDPUs.
 
-        returns: the received BDPUs.
+        returns: the received BDPUs, as a read-only tuple.
+        """
+        return tuple(self._received_bdpus)
+
+    def receive_bdpu(self, bdpu: BridgeProtocolDataUnit):
         """
-        return self._received_bdpus.copy()
+        Receive a BDPU, without forwarding it to any listeners.
+        """
+        self._received_bdpus.append(bdpu)
 
     @property
     def listened(self):
@@ -280,33 +476,48 @@ class Bridge:
     def send_bdpu(self, bdpu):
         """
         Send a BDPU to all of its listeners.
-        """
-        copied_bdpu = bdpu.copy()
-        copied_bdpu.add_bridge(self)
-        copied_bdpu.add_cost(self._cost)
-        self._received_bdpus.append(copied_bdpu)
-        for listener in self.listeners:
-            listener.send_bdpu(bdpu)
+
+        The BDPU is flooded depth-first; each bridge receives its own BDPU
+        carrying the path and cost accumulated along its branch. Bridges
+        already on a branch's path are not revisited.
+        """
+        # keyed by id, since distinct bridges may share a name
+        on_path = set()
+        stack = [(self, bdpu)]
+        while stack:
+            bridge, incoming_bdpu = stack.pop()
+            if incoming_bdpu is None:
+                # every branch through this bridge has been flooded
+                on_path.remove(id(bridge))
+                continue
+
+            received_bdpu = incoming_bdpu.add_bridge(bridge, bridge.cost)
+            bridge.receive_bdpu(received_bdpu)
+            on_path.add(id(bridge))
+            stack.append((bridge, None))
+            stack.extend(
+                (listener, received_bdpu)
+                for listener in bridge.listeners
+                if id(listener) not in on_path)
 
     def set_listener(self, other: 'Bridge'):
         """
         Set another bridge as a listener of this bridge.
-        """
-        unallocated_port = self.unallocated_port
-        if not unallocated_port:
-            raise ValueError("No free ports.")
 
+        returns: the port the other bridge listens on.
+        """
+        unallocated_port = self._free_port_or_raise(self._listeners)
         self._listeners[unallocated_port.number] = other
+        _invalidate_shortest_paths()
+        return unallocated_port
 
     @property
     def unallocated_port(self):
         """
         An unallocated port.
 
-        returns: an unallocated port
+        returns: a port that is not listening to a bridge yet, or else one
+        that is not listened to by a bridge yet, or None.
         """
-        for port in self._ports:
-            if not port.connected:
-                return port
-
-        return None
+        return self._free_port(self._listened) \
+            or self._free_port(self._listeners)
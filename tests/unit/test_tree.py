@@ -1,8 +1,12 @@
 # pylint: disable=missing-docstring
 
 import collections
+import gc
 import logging
 import logging.config
+import random
+import weakref
+import pytest
 import spanning_tree.tree as spanning_tree_tree
 
 logging.config.dictConfig(
@@ -118,3 +122,252 @@ def test_tree_shortest_path_least_bridges():
             == spanning_tree_tree.shortest_path(
                     expectation.root_bridge,
                     expectation.sending_bridge)
+
+def test_tree_shortest_path_unreachable_root():
+    # root    a(1) <- b(1)
+    #
+    # root never listens to a, so b has no path to it.
+    root_bridge = spanning_tree_tree.Bridge('root')
+    root_bridge.elect()
+
+    bridge_a = spanning_tree_tree.Bridge('a')
+    bridge_b = spanning_tree_tree.Bridge('b')
+
+    bridge_a.connect(bridge_b)
+
+    with pytest.raises(ValueError):
+        spanning_tree_tree.shortest_path(root_bridge, bridge_b)
+
+def test_tree_shortest_path_topology_change():
+    # root <- a(1) <- b(1)
+    #
+    # Shortest path is:
+    # root <- a <- b
+    #
+    # and, after connecting c:
+    # root <- a <- b <- c
+    root_bridge = spanning_tree_tree.Bridge('root')
+    root_bridge.elect()
+
+    bridge_a = spanning_tree_tree.Bridge('a')
+    bridge_b = spanning_tree_tree.Bridge('b')
+    bridge_c = spanning_tree_tree.Bridge('c')
+
+    root_bridge.connect(bridge_a)
+    bridge_a.connect(bridge_b)
+
+    shortest_path = spanning_tree_tree.shortest_path(root_bridge, bridge_b)
+    assert [bridge_b, bridge_a, root_bridge] == shortest_path
+
+    shortest_path.clear()
+    assert [bridge_b, bridge_a, root_bridge] \
+        == spanning_tree_tree.shortest_path(root_bridge, bridge_b)
+
+    with pytest.raises(ValueError):
+        spanning_tree_tree.shortest_path(root_bridge, bridge_c)
+
+    bridge_b.connect(bridge_c)
+
+    assert [bridge_c, bridge_b, bridge_a, root_bridge] \
+        == spanning_tree_tree.shortest_path(root_bridge, bridge_c)
+
+def test_tree_shortest_path_releases_bridges(caplog):
+    # root <- a(1)
+    #
+    # Once the topology changes, nothing cached for it keeps a alive. Debug
+    # records would hold on to the path, so they are not emitted here.
+    caplog.set_level(logging.INFO, logger='spanning_tree.tree')
+    root_bridge = spanning_tree_tree.Bridge('root')
+    bridge_a = spanning_tree_tree.Bridge('a')
+
+    root_bridge.connect(bridge_a)
+    spanning_tree_tree.shortest_path(root_bridge, bridge_a)
+
+    released_bridge = weakref.ref(bridge_a)
+    del root_bridge, bridge_a
+
+    spanning_tree_tree.Bridge('b').connect(spanning_tree_tree.Bridge('c'))
+    gc.collect()
+
+    assert released_bridge() is None
+
+def test_bridge_send_bdpu():
+    # root <- a(1) <- b(2)
+    root_bridge = spanning_tree_tree.Bridge('root')
+    root_bridge.elect()
+
+    bridge_a = spanning_tree_tree.Bridge('a')
+    bridge_b = spanning_tree_tree.Bridge('b', cost=2)
+
+    root_bridge.connect(bridge_a)
+    bridge_a.connect(bridge_b)
+
+    bdpu = spanning_tree_tree.BridgeProtocolDataUnit('b', 'root')
+    bridge_b.send_bdpu(bdpu)
+
+    assert not bdpu.path
+    assert 0 == bdpu.total_cost
+
+    assert 1 == len(root_bridge.received_bdpus)
+    received_bdpu = root_bridge.received_bdpus[0]
+    assert (bridge_b, bridge_a, root_bridge) == received_bdpu.path
+    assert 4 == received_bdpu.total_cost
+    assert received_bdpu is root_bridge.best_bdpu
+
+    assert 1 == len(bridge_a.received_bdpus)
+    received_bdpu = bridge_a.received_bdpus[0]
+    assert (bridge_b, bridge_a) == received_bdpu.path
+    assert 3 == received_bdpu.total_cost
+
+def test_port_equality():
+    port = spanning_tree_tree.Port(1024)
+
+    assert spanning_tree_tree.Port(1024) == port
+    assert spanning_tree_tree.Port(1025) != port
+    assert port != 1024
+    assert {port} == {spanning_tree_tree.Port(1024)}
+
+def test_bridge_connect_no_free_ports():
+    # a(1) <- b(1) <- c(1)
+    #
+    # b's only port is both listened to and listening, so it cannot
+    # connect to d.
+    bridge_a = spanning_tree_tree.Bridge('a')
+    bridge_b = spanning_tree_tree.Bridge('b')
+    bridge_c = spanning_tree_tree.Bridge('c')
+    bridge_d = spanning_tree_tree.Bridge('d')
+
+    bridge_a.connect(bridge_b)
+    bridge_b.connect(bridge_c)
+
+    assert bridge_b.unallocated_port is None
+    with pytest.raises(ValueError):
+        bridge_b.connect(bridge_d)
+
+    with pytest.raises(ValueError):
+        bridge_d.connect(bridge_b)
+
+    assert [bridge_c] == list(bridge_b.listened)
+    assert [bridge_a] == list(bridge_b.listeners)
+    assert not list(bridge_d.listened)
+
+def test_bridge_connect_each_port_once():
+    # root <- x(1)
+    #      <- w(1)
+    #
+    # root has one port for each bridge it listens to, and none for a third.
+    root_bridge = spanning_tree_tree.Bridge(
+        'root',
+        spanning_tree_tree.Port(1024),
+        spanning_tree_tree.Port(1025))
+    bridge_v = spanning_tree_tree.Bridge('v')
+    bridge_w = spanning_tree_tree.Bridge('w')
+    bridge_x = spanning_tree_tree.Bridge('x')
+
+    root_bridge.connect(bridge_x)
+    root_bridge.connect(bridge_w)
+
+    assert [bridge_x, bridge_w] == list(root_bridge.listened)
+    with pytest.raises(ValueError):
+        root_bridge.connect(bridge_v)
+
+    assert not list(bridge_v.listeners)
+
+def test_bridge_send_bdpu_cycle():
+    # a(1) <- b(1) <- c(1) <- a(1)
+    bridge_a = spanning_tree_tree.Bridge('a')
+    bridge_b = spanning_tree_tree.Bridge('b')
+    bridge_c = spanning_tree_tree.Bridge('c')
+
+    bridge_a.connect(bridge_b)
+    bridge_b.connect(bridge_c)
+    bridge_c.connect(bridge_a)
+
+    bridge_a.send_bdpu(spanning_tree_tree.BridgeProtocolDataUnit('a', 'b'))
+
+    assert 1 == len(bridge_b.received_bdpus)
+    received_bdpu = bridge_b.received_bdpus[0]
+    assert (bridge_a, bridge_c, bridge_b) == received_bdpu.path
+    assert 1 == len(bridge_a.received_bdpus)
+    assert 1 == len(bridge_c.received_bdpus)
+
+def test_bridge_send_bdpu_same_name():
+    # z(1) <- n(1) <- n(1)
+    #
+    # The two bridges named n are distinct, so the BDPU reaches z.
+    bridge_x = spanning_tree_tree.Bridge('n')
+    bridge_y = spanning_tree_tree.Bridge('n')
+    bridge_z = spanning_tree_tree.Bridge(
+        'z',
+        spanning_tree_tree.Port(1024),
+        spanning_tree_tree.Port(1025))
+
+    bridge_z.connect(bridge_x)
+    bridge_x.connect(bridge_y)
+
+    bridge_y.send_bdpu(spanning_tree_tree.BridgeProtocolDataUnit('n', 'z'))
+
+    assert 1 == len(bridge_z.received_bdpus)
+    received_bdpu = bridge_z.received_bdpus[0]
+    assert 3 == len(received_bdpu.path)
+    assert received_bdpu.path[0] is bridge_y
+    assert received_bdpu.path[1] is bridge_x
+
+def test_tree_shortest_path_least_cost():
+    # root <- x(5)        <- s(1)
+    #      <- w(1) <- y(1) <-
+    #
+    # Shortest path is:
+    # root <- w <- y <- s
+    root_bridge = spanning_tree_tree.Bridge(
+        'root',
+        spanning_tree_tree.Port(1024),
+        spanning_tree_tree.Port(1025))
+    root_bridge.elect()
+
+    bridge_s = spanning_tree_tree.Bridge(
+        's',
+        spanning_tree_tree.Port(1024),
+        spanning_tree_tree.Port(1025))
+    bridge_w = spanning_tree_tree.Bridge('w')
+    bridge_x = spanning_tree_tree.Bridge('x', cost=5)
+    bridge_y = spanning_tree_tree.Bridge('y')
+
+    root_bridge.connect(bridge_x)
+    root_bridge.connect(bridge_w)
+    bridge_w.connect(bridge_y)
+
+    bridge_x.connect(bridge_s)
+    bridge_y.connect(bridge_s)
+
+    assert [bridge_s, bridge_y, bridge_w, root_bridge] \
+        == spanning_tree_tree.shortest_path(root_bridge, bridge_s)
+
+def test_port_number_range():
+    assert 1024 == spanning_tree_tree.Port(1024).number
+    assert 65535 == spanning_tree_tree.Port(65535).number
+
+    for number in [0, 1023, 65536]:
+        with pytest.raises(ValueError):
+            spanning_tree_tree.Port(number)
+
+def test_tree_shortest_path_fractional_cost():
+    # root <- a(0.5) <- b(1.5)
+    root_bridge = spanning_tree_tree.Bridge('root')
+    root_bridge.elect()
+
+    bridge_a = spanning_tree_tree.Bridge('a', cost=0.5)
+    bridge_b = spanning_tree_tree.Bridge('b', cost=1.5)
+
+    root_bridge.connect(bridge_a)
+    bridge_a.connect(bridge_b)
+
+    assert [bridge_b, bridge_a, root_bridge] \
+        == spanning_tree_tree.shortest_path(root_bridge, bridge_b)
+
+def test_port_ephemeral_number_seeded():
+    random.seed(1)
+    number = spanning_tree_tree.Port().number
+    random.seed(1)
+
+    assert number == spanning_tree_tree.Port().number